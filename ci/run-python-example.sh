@@ -13,3 +13,4 @@ fi
 export STORAGE_EMULATOR_HOST=http://localhost:8080
 pip install -r examples/python/requirements.txt
 python examples/python/python.py
+python examples/python/python_async.py
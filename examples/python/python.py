@@ -2,27 +2,249 @@
 # Use of this source code is governed by a BSD-style
 # license that can be found in the LICENSE file.
 
-import tempfile
+import collections
+import io
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
 
+import requests
 from google.auth.credentials import AnonymousCredentials
 from google.cloud import storage
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
-client = storage.Client(
-    credentials=AnonymousCredentials(),
-    project="test",
-)
-
-# List the Buckets
-for bucket in client.list_buckets():
-    print(f"Bucket: {bucket.name}\n")
-
-    # List the Blobs in each Bucket
-    for blob in bucket.list_blobs():
-        print(f"Blob: {blob.name}")
-
-        # Print the content of the Blob
-        b = bucket.get_blob(blob.name)
-        with tempfile.NamedTemporaryFile() as temp_file:
-            s = b.download_to_filename(temp_file.name)
-            temp_file.seek(0, 0)
-            print(temp_file.read(), "\n")
+# Number of blobs downloaded concurrently. The connection pool below must fit
+# these plus MULTIPART_PARTS, otherwise urllib3 discards connections once it is
+# full.
+MAX_WORKERS = 16
+
+# Number of downloads kept in flight ahead of the blob being written out. Twice
+# the number of workers keeps them busy without holding every downloaded blob
+# in memory at once.
+PREFETCH_DEPTH = 2 * MAX_WORKERS
+
+# Blobs larger than this are split into byte ranges downloaded in parallel,
+# instead of going through a single connection.
+MULTIPART_THRESHOLD = 8 * 1024 * 1024
+MULTIPART_PARTS = 8
+
+# Number of times a download is attempted before giving up. Each retry resumes
+# from the last byte written instead of downloading the blob from scratch.
+DOWNLOAD_ATTEMPTS = 5
+
+# Content served by a local emulator is trusted, so downloads from it skip
+# checksum validation. Against the real service, whole-blob downloads are
+# validated with crc32c, computed by the google-crc32c C extension that
+# google-resumable-media depends on. Either way, raw downloads are also checked
+# against the blob's size, which catches truncation but not corruption.
+DOWNLOAD_CHECKSUM = None if os.environ.get("STORAGE_EMULATOR_HOST") else "crc32c"
+
+# Fields requested when listing buckets and blobs: just what's needed to
+# download each blob, so responses stay small and no further metadata requests
+# are necessary.
+BUCKET_FIELDS = "items(name),nextPageToken"
+BLOB_FIELDS = "items(name,size,generation,contentEncoding),nextPageToken"
+
+# Output is written straight to the binary stdout, and only flushed after this
+# many blobs.
+FLUSH_INTERVAL = 64
+
+_client = None
+
+
+def get_client():
+    # The client is created once and shared by every thread, along with a
+    # single keep-alive session, so listing and downloading blobs reuse
+    # connections instead of opening a new one per call.
+    global _client
+    if _client is not None:
+        return _client
+
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=32,
+        pool_maxsize=64,
+        max_retries=Retry(
+            total=5,
+            backoff_factor=0.2,
+            status_forcelist=(500, 502, 503, 504),
+        ),
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+
+    # When the server runs with "-scheme https", keep certificate verification
+    # on and point REQUESTS_CA_BUNDLE at the server's certificate instead of
+    # setting session.verify to False: requests picks it up for every call,
+    # and the TLS connections stay pooled in the session like the plain HTTP
+    # ones.
+
+    _client = storage.Client(
+        credentials=AnonymousCredentials(),
+        project="test",
+        _http=session,
+    )
+    return _client
+
+
+class BufferWriter:
+    # Writable file object over a preallocated buffer, so raw downloads, whose
+    # size is known from the listing, are written straight into place instead
+    # of into a growing buffer that's copied out afterwards.
+    def __init__(self, buffer):
+        self._buffer = buffer
+        self._offset = 0
+
+    def write(self, data):
+        end = self._offset + len(data)
+        if end > len(self._buffer):
+            raise IOError(f"got more than the expected {len(self._buffer)} bytes")
+        self._buffer[self._offset : end] = data
+        self._offset = end
+        return len(data)
+
+    def tell(self):
+        return self._offset
+
+
+def download_resumable(blob, file_obj, start, end, checksum=None):
+    # Downloads bytes start through end of the raw blob into file_obj, resuming
+    # from the last byte written whenever a response fails or comes up short.
+    # urllib3 doesn't enforce Content-Length, so a connection closed early by
+    # the server doesn't always raise: the length written is what tells
+    # whether the download is complete.
+    #
+    # This loop owns resumption, so the client's own download retries are
+    # disabled; the session adapter only retries requests that never got a
+    # response.
+    length = end - start + 1
+    error = None
+    for _ in range(DOWNLOAD_ATTEMPTS):
+        written = file_obj.tell()
+        if written >= length:
+            break
+
+        # Partial responses aren't validated against the checksum, so a first
+        # attempt covering the whole blob is sent without a range.
+        whole = start + written == 0 and end == blob.size - 1
+        try:
+            blob.download_to_file(
+                file_obj,
+                start=None if whole else start + written,
+                end=None if whole else end,
+                raw_download=True,
+                checksum=checksum if whole else None,
+                retry=None,
+            )
+        except (
+            ConnectionError,
+            requests.exceptions.ConnectionError,
+            requests.exceptions.ChunkedEncodingError,
+        ) as e:
+            error = e
+
+    if file_obj.tell() != length:
+        raise IOError(
+            f"{blob.name}: got {file_obj.tell()} of {length} bytes "
+            f"after {DOWNLOAD_ATTEMPTS} attempts"
+        ) from error
+
+
+def download_part(blob, buffer, start, end):
+    # The hash headers returned by the server describe the whole object, so
+    # they can't be used to validate a single range.
+    download_resumable(blob, BufferWriter(buffer[start : end + 1]), start, end)
+
+
+def download_parts(blob):
+    # Raw downloads are exactly blob.size bytes long, so the whole blob is
+    # allocated once and each range is written into its own slice.
+    content = bytearray(blob.size)
+    buffer = memoryview(content)
+    part_size = -(-blob.size // MULTIPART_PARTS)
+    futures = [
+        part_executor.submit(
+            download_part,
+            blob,
+            buffer,
+            start,
+            min(start + part_size, blob.size) - 1,
+        )
+        for start in range(0, blob.size, part_size)
+    ]
+    for future in futures:
+        future.result()
+    return content
+
+
+def download(blob):
+    # blobs returned by list_blobs already carry their metadata, so there's no
+    # need for an extra get_blob round-trip before downloading them.
+    #
+    # Leaving blob.chunk_size unset keeps the download on the single-request
+    # path, and raw_download skips transparent decoding for blobs that aren't
+    # gzip-encoded anyway.
+    raw_download = blob.content_encoding != "gzip"
+    if raw_download and (blob.size or 0) > MULTIPART_THRESHOLD:
+        return blob.name, download_parts(blob)
+
+    # The content is only used in memory, so there's no point in writing it to
+    # a file and reading it back.
+    if raw_download and blob.size is not None:
+        content = bytearray(blob.size)
+        download_resumable(
+            blob,
+            BufferWriter(memoryview(content)),
+            0,
+            blob.size - 1,
+            DOWNLOAD_CHECKSUM,
+        )
+        return blob.name, content
+
+    # Offsets into a transparently decoded stream don't match the stored
+    # object, so these can't be resumed, and their length isn't known up
+    # front.
+    buffer = io.BytesIO()
+    blob.download_to_file(
+        buffer,
+        raw_download=raw_download,
+        checksum=DOWNLOAD_CHECKSUM,
+    )
+    return blob.name, buffer.getvalue()
+
+
+def download_ahead(blobs):
+    # Like executor.map, but only submits up to PREFETCH_DEPTH downloads ahead
+    # of the one being consumed, instead of all of them at once.
+    pending = collections.deque()
+    for blob in blobs:
+        pending.append(executor.submit(download, blob))
+        if len(pending) >= PREFETCH_DEPTH:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+executor = ThreadPoolExecutor(max_workers=MAX_WORKERS)
+part_executor = ThreadPoolExecutor(max_workers=MULTIPART_PARTS)
+out = sys.stdout.buffer
+
+with executor, part_executor:
+    # List the Buckets
+    for bucket in get_client().list_buckets(fields=BUCKET_FIELDS):
+        out.write(f"Bucket: {bucket.name}\n\n".encode())
+
+        # List the Blobs in each Bucket once and download them concurrently
+        blobs = list(bucket.list_blobs(fields=BLOB_FIELDS))
+        results = download_ahead(blobs)
+        for i, (name, content) in enumerate(results, 1):
+            out.write(f"Blob: {name}\n".encode())
+
+            # Print the content of the Blob, as is
+            out.write(content)
+            out.write(b"\n\n")
+            if i % FLUSH_INTERVAL == 0:
+                out.flush()
+
+out.flush()
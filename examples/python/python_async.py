@@ -0,0 +1,65 @@
+# Copyright 2026 Francisco Souza. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+# Asynchronous version of python.py, downloading every blob from a single event
+# loop using gcloud-aio-storage.
+import asyncio
+import sys
+
+from gcloud.aio.storage import Storage
+
+# Maximum number of downloads in flight at once, kept below aiohttp's default
+# limit of 100 connections per session.
+MAX_CONCURRENT_DOWNLOADS = 32
+
+# Fields requested when listing buckets and blobs. gcloud-aio-storage only needs
+# the id of each bucket.
+BUCKET_FIELDS = "items(id),nextPageToken"
+BLOB_FIELDS = "items(name),nextPageToken"
+
+
+async def list_blob_names(storage, bucket):
+    params = {"fields": BLOB_FIELDS}
+    names = []
+    while True:
+        page = await storage.list_objects(bucket, params=params)
+        names.extend(item["name"] for item in page.get("items", []))
+        if not page.get("nextPageToken"):
+            return names
+        params["pageToken"] = page["nextPageToken"]
+
+
+async def download(storage, semaphore, bucket, name):
+    async with semaphore:
+        return name, await storage.download(bucket, name)
+
+
+async def main():
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_DOWNLOADS)
+    out = sys.stdout.buffer
+    async with Storage() as storage:
+        # List the Buckets
+        for bucket in await storage.list_buckets(
+            "test", params={"fields": BUCKET_FIELDS}
+        ):
+            out.write(f"Bucket: {bucket.name}\n\n".encode())
+
+            # List the Blobs in each Bucket and download them concurrently,
+            # writing each one out as soon as it's done instead of holding the
+            # whole bucket in memory
+            names = await list_blob_names(storage, bucket.name)
+            downloads = [
+                download(storage, semaphore, bucket.name, name) for name in names
+            ]
+            for result in asyncio.as_completed(downloads):
+                name, content = await result
+                out.write(f"Blob: {name}\n".encode())
+
+                # Print the content of the Blob, as is
+                out.write(content)
+                out.write(b"\n\n")
+            out.flush()
+
+
+asyncio.run(main())